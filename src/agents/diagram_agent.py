@@ -1,15 +1,22 @@
 """Simplified diagram generation agent."""
 
+import asyncio
 import logging
 import time
+from concurrent.futures import Executor
 from pathlib import Path
 
 import google.generativeai as genai
 
-from src.config import settings
+from src.config import get_settings
 from src.models.schemas import DiagramRequest, DiagramResponse, ErrorResponse
-from src.tools.diagram_tools import create_diagram_from_description
+from src.tools.diagram_tools import (
+    create_diagram_from_description,
+    diagram_cache_key,
+    diagram_cache_path,
+)
 from src.tools.validators import ValidationError, validate_description
+from src.utils.file_manager import file_manager
 
 logger = logging.getLogger(__name__)
 
@@ -17,17 +24,26 @@ logger = logging.getLogger(__name__)
 class DiagramAgent:
     """Simple diagram generation agent."""
 
-    def __init__(self):
-        """Initialize the agent."""
+    def __init__(self, render_pool: Executor | None = None):
+        """Initialize the agent.
+
+        Args:
+            render_pool: Executor used for Graphviz rendering. Uses the event
+                loop's default executor if None.
+        """
         self.model = None
+        self.render_pool = render_pool
+        self._inflight: dict[str, asyncio.Task[Path]] = {}
 
+        settings = get_settings()
+        self._render_slots = asyncio.Semaphore(settings.max_concurrent_renders)
         if not settings.mock_mode and settings.gemini_api_key:
             try:
                 genai.configure(api_key=settings.gemini_api_key)
                 self.model = genai.GenerativeModel("gemini-1.5-flash")
                 logger.info("Initialized Gemini API")
             except Exception as e:
-                logger.error(f"Failed to initialize Gemini: {e}")
+                logger.error("Failed to initialize Gemini: %s", e)
 
     async def generate_diagram(
         self, request: DiagramRequest
@@ -40,25 +56,73 @@ class DiagramAgent:
             validate_description(request.description)
 
             # Generate diagram
-            if settings.mock_mode or not self.model:
-                diagram_path = self._create_mock_diagram(request)
+            cache_key = diagram_cache_key(
+                request.description, request.provider, request.direction
+            )
+            diagram_path = diagram_cache_path(cache_key)
+            if cache_key not in self._inflight and file_manager.touch_file(
+                diagram_path
+            ):
+                # Serve rendered diagrams without waiting for a render slot;
+                # a key still rendering joins that render instead
+                logger.debug("Diagram cache hit: %s", diagram_path)
             else:
-                diagram_path = await self._generate_with_llm(request)
+                diagram_path = await self._generate_once(request, cache_key)
 
-            return DiagramResponse(
+            # Fields are built here from trusted values, so skip validation
+            return DiagramResponse.model_construct(
                 diagram_path=str(diagram_path),
                 generation_time_seconds=time.time() - start_time,
+                cache_key=cache_key,
             )
 
         except ValidationError as e:
-            return ErrorResponse(error=str(e), details={"type": "validation_error"})
+            return ErrorResponse.model_construct(
+                error=str(e), details={"type": "validation_error"}
+            )
         except Exception as e:
-            logger.error(f"Diagram generation failed: {e}")
-            return ErrorResponse(error=str(e), details={"type": "generation_error"})
+            logger.error("Diagram generation failed: %s", e)
+            return ErrorResponse.model_construct(
+                error=str(e), details={"type": "generation_error"}
+            )
+
+    async def _generate_once(self, request: DiagramRequest, cache_key: str) -> Path:
+        """Generate a diagram, sharing the work between identical requests.
+
+        Concurrent requests with the same cache key await the task started by
+        the first one instead of rendering the same diagram again.
+        """
+        task = self._inflight.get(cache_key)
+        if task is None:
+            if get_settings().mock_mode or not self.model:
+                task = asyncio.create_task(self._create_mock_diagram(request))
+            else:
+                task = asyncio.create_task(self._generate_with_llm(request))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+
+        # Shield so one cancelled caller doesn't cancel the shared work
+        return await asyncio.shield(task)
+
+    async def _render(self, request: DiagramRequest) -> Path:
+        """Render a diagram off the event loop in the render pool.
+
+        At most ``max_concurrent_renders`` renders run at once; each finished
+        render immediately frees its slot for the next waiting request.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._render_slots:
+            return await loop.run_in_executor(
+                self.render_pool,
+                create_diagram_from_description,
+                request.description,
+                request.provider,
+                request.direction,
+            )
 
-    def _create_mock_diagram(self, request: DiagramRequest) -> Path:
+    async def _create_mock_diagram(self, request: DiagramRequest) -> Path:
         """Create a mock diagram for development."""
-        return create_diagram_from_description(request.description, request.provider)
+        return await self._render(request)
 
     async def _generate_with_llm(self, request: DiagramRequest) -> Path:
         """Generate diagram using LLM (future implementation)."""
@@ -67,22 +131,4 @@ class DiagramAgent:
         # 1. Send prompt to LLM
         # 2. Parse LLM response
         # 3. Use DiagramBuilder to create diagram
-        return create_diagram_from_description(request.description, request.provider)
-
-
-# Global agent instance
-_agent: DiagramAgent | None = None
-
-
-async def get_agent() -> DiagramAgent:
-    """Get the global agent instance."""
-    global _agent
-    if _agent is None:
-        _agent = DiagramAgent()
-    return _agent
-
-
-async def generate_diagram(request: DiagramRequest) -> DiagramResponse | ErrorResponse:
-    """Generate a diagram from request."""
-    agent = await get_agent()
-    return await agent.generate_diagram(request)
+        return await self._render(request)
@@ -1,6 +1,7 @@
 """Configuration management for the diagrams workflow service."""
 
 import logging
+from functools import lru_cache
 from pathlib import Path
 
 from pydantic import Field
@@ -29,6 +30,10 @@ class Settings(BaseSettings):
     max_file_age_minutes: int = Field(
         default=60, description="Maximum age of temporary files in minutes"
     )
+    accel_redirect_prefix: str | None = Field(
+        default=None,
+        description="Internal nginx location serving temp_dir via X-Accel-Redirect",
+    )
 
     # API Server Configuration
     host: str = Field(default="0.0.0.0", description="Host to bind the server to")
@@ -46,6 +51,11 @@ class Settings(BaseSettings):
         default=False, description="Use mock responses instead of real LLM calls"
     )
 
+    # Rendering Configuration
+    max_concurrent_renders: int = Field(
+        default=8, ge=1, description="Maximum number of diagrams rendered at once"
+    )
+
     def setup_logging(self) -> None:
         """Configure logging based on settings."""
         log_level = getattr(logging, self.log_level.upper(), logging.INFO)
@@ -71,5 +81,7 @@ class Settings(BaseSettings):
         return not self.debug_mode and not self.reload
 
 
-# Global settings instance
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Get the application settings, loading them on first use."""
+    return Settings()
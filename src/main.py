@@ -2,84 +2,137 @@
 
 import asyncio
 import logging
+import os
+import re
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import quote
 
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
+from starlette.types import Receive, Scope, Send
 
-from src.agents.diagram_agent import generate_diagram
-from src.config import settings
+from src.agents.diagram_agent import DiagramAgent
+from src.config import get_settings
 from src.models.schemas import (
     AssistantRequest,
     AssistantResponse,
+    BatchDiagramRequest,
+    BatchDiagramResponse,
     DiagramRequest,
     DiagramResponse,
     ErrorResponse,
     HealthResponse,
 )
+from src.tools.diagram_tools import init_render_worker
 from src.utils.file_manager import file_manager
 
-# Configure logging
-settings.setup_logging()
+settings = get_settings()
 logger = logging.getLogger(__name__)
 
-# Create FastAPI app
-app = FastAPI(
-    title="Diagrams Workflow Service",
-    description="Generate infrastructure diagrams from natural language descriptions",
-    version="0.1.0",
-    docs_url="/docs" if settings.debug_mode else None,
-    redoc_url="/redoc" if settings.debug_mode else None,
-)
+# Diagram filenames are re-rendered after cleanup and across deploys, so
+# clients cache briefly and then revalidate against the ETag
+DIAGRAM_CACHE_CONTROL = "public, max-age=300"
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"] if settings.debug_mode else ["http://localhost:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# Simple heuristic to detect diagram requests
+DIAGRAM_REQUEST_RE = re.compile(
+    r"diagram|architecture|infrastructure|draw|create|show", re.IGNORECASE
 )
+# Text after "diagram", skipping leading "of", "for" and ":" connectors
+DIAGRAM_SUBJECT_RE = re.compile(
+    r"diagram(?:\s*(?:(?:of|for)\b|:))*\s*(.*)", re.IGNORECASE | re.DOTALL
+)
+
 
+def attachment_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition the same way FileResponse does."""
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return f"attachment; filename*=utf-8''{quoted_filename}"
+    return f'attachment; filename="{filename}"'
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize the application on startup."""
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Set up shared resources on startup and release them on shutdown."""
+    settings.setup_logging()
     logger.info("Starting diagrams workflow service")
 
     # Ensure temp directory exists
     settings.ensure_temp_dir()
     file_manager.ensure_temp_dir_exists()
 
+    # Keep a warm pool of render workers so Graphviz runs off the event loop
+    app.state.render_pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count(), initializer=init_render_worker
+    )
+    app.state.agent = DiagramAgent(render_pool=app.state.render_pool)
+
     # Start periodic cleanup task
     cleanup_task = asyncio.create_task(file_manager.cleanup_periodically())
-    app.state.cleanup_task = cleanup_task
 
     logger.info(
-        f"Service started in {'mock' if settings.mock_mode else 'production'} mode"
+        "Service started in %s mode", "mock" if settings.mock_mode else "production"
     )
 
+    yield
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on application shutdown."""
     logger.info("Shutting down diagrams workflow service")
 
     # Cancel cleanup task
-    if hasattr(app.state, "cleanup_task"):
-        app.state.cleanup_task.cancel()
-        try:
-            await app.state.cleanup_task
-        except asyncio.CancelledError:
-            pass
+    cleanup_task.cancel()
+    try:
+        await cleanup_task
+    except asyncio.CancelledError:
+        pass
+
+    # Stop render workers
+    app.state.render_pool.shutdown(wait=False, cancel_futures=True)
 
     # Final cleanup
     file_manager.cleanup_old_files()
     logger.info("Service shutdown complete")
 
 
+# Create FastAPI app
+app = FastAPI(
+    title="Diagrams Workflow Service",
+    description="Generate infrastructure diagrams from natural language descriptions",
+    version="0.1.0",
+    docs_url="/docs" if settings.debug_mode else None,
+    redoc_url="/redoc" if settings.debug_mode else None,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"] if settings.debug_mode else ["http://localhost:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """Gzip API responses, leaving already-deflated PNG downloads alone."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith("/diagrams/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(JSONGZipMiddleware, minimum_size=200, compresslevel=5)
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint."""
@@ -92,72 +145,92 @@ async def health_check():
 async def generate_diagram_endpoint(request: DiagramRequest):
     """Generate a diagram from natural language description."""
     try:
-        logger.info(f"Generating diagram: {request.description[:100]}...")
+        logger.info("Generating diagram: %s...", request.description[:100])
 
-        result = await generate_diagram(request)
+        result = await app.state.agent.generate_diagram(request)
 
         if isinstance(result, ErrorResponse):
             raise HTTPException(status_code=400, detail=result.error)
 
-        logger.info(f"Diagram generated successfully: {result.diagram_path}")
+        logger.info("Diagram generated successfully: %s", result.diagram_path)
         return result
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Diagram generation failed: {e}")
+        logger.error("Diagram generation failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@app.post("/generate-diagram/batch", response_model=BatchDiagramResponse)
+async def generate_diagram_batch_endpoint(
+    request: BatchDiagramRequest,
+) -> BatchDiagramResponse:
+    """Generate several diagrams concurrently."""
+    logger.info("Generating batch of %s diagrams", len(request.items))
+
+    agent: DiagramAgent = app.state.agent
+    results = await asyncio.gather(
+        *(agent.generate_diagram(item) for item in request.items),
+        return_exceptions=True,
+    )
+
+    responses: list[DiagramResponse | ErrorResponse] = []
+    for result in results:
+        if isinstance(result, Exception):
+            responses.append(ErrorResponse(error=str(result)))
+        elif isinstance(result, BaseException):
+            # Cancellation and interpreter exits are not per-item failures
+            raise result
+        else:
+            responses.append(result)
+
+    return BatchDiagramResponse(results=responses)
+
+
 @app.get("/diagrams/{filename}")
-async def get_diagram(filename: str):
+async def get_diagram(filename: str, request: Request):
     """Serve generated diagram files."""
-    try:
-        file_path = file_manager.get_temp_path(filename)
+    file_path = file_manager.get_temp_path(filename)
 
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Diagram not found")
+    stat_result = file_manager.stat_file(file_path)
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Diagram not found")
 
-        return FileResponse(path=file_path, media_type="image/png", filename=filename)
+    etag = f'"{stat_result.st_size:x}-{int(stat_result.st_mtime):x}"'
+    headers = {"Cache-Control": DIAGRAM_CACHE_CONTROL, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error serving diagram {filename}: {e}")
-        raise HTTPException(status_code=500, detail="Failed to serve diagram") from e
+    # Let the reverse proxy send the file bytes itself
+    if settings.accel_redirect_prefix:
+        headers["X-Accel-Redirect"] = (
+            f"{settings.accel_redirect_prefix.rstrip('/')}/{quote(file_path.name)}"
+        )
+        headers["Content-Disposition"] = attachment_disposition(filename)
+        return Response(media_type="image/png", headers=headers)
+
+    return FileResponse(
+        path=file_path,
+        media_type="image/png",
+        filename=filename,
+        headers=headers,
+        stat_result=stat_result,
+    )
 
 
 @app.post("/assistant", response_model=AssistantResponse)
 async def assistant_endpoint(request: AssistantRequest):
     """Assistant chat endpoint that can generate diagrams."""
     try:
-        message = request.message.lower()
-
-        # Simple heuristic to detect diagram requests
-        diagram_keywords = [
-            "diagram",
-            "architecture",
-            "infrastructure",
-            "draw",
-            "create",
-            "show",
-        ]
-        needs_diagram = any(keyword in message for keyword in diagram_keywords)
-
-        if needs_diagram:
+        if DIAGRAM_REQUEST_RE.search(request.message):
             # Extract description (simple approach)
-            description = request.message
-            if "diagram" in message:
-                # Try to extract text after "diagram"
-                parts = message.split("diagram", 1)
-                if len(parts) > 1:
-                    description = (
-                        parts[1].strip().lstrip("of").lstrip("for").lstrip(":").strip()
-                    )
+            subject = DIAGRAM_SUBJECT_RE.search(request.message)
+            description = subject.group(1).strip() if subject else request.message
 
             # Generate diagram
             diagram_request = DiagramRequest(description=description)
-            result = await generate_diagram(diagram_request)
+            result = await app.state.agent.generate_diagram(diagram_request)
 
             if isinstance(result, ErrorResponse):
                 return AssistantResponse(
@@ -179,7 +252,7 @@ async def assistant_endpoint(request: AssistantRequest):
             )
 
     except Exception as e:
-        logger.error(f"Assistant endpoint error: {e}")
+        logger.error("Assistant endpoint error: %s", e)
         return AssistantResponse(
             response="I encountered an error processing your request. Please try again."
         )
@@ -188,21 +261,17 @@ async def assistant_endpoint(request: AssistantRequest):
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
     """Handle 404 errors."""
-    return Response(
-        content='{"success": false, "error": "Endpoint not found"}',
-        status_code=404,
-        media_type="application/json",
+    return ORJSONResponse(
+        {"success": False, "error": "Endpoint not found"}, status_code=404
     )
 
 
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
     """Handle internal server errors."""
-    logger.error(f"Internal server error: {exc}")
-    return Response(
-        content='{"success": false, "error": "Internal server error"}',
-        status_code=500,
-        media_type="application/json",
+    logger.error("Internal server error: %s", exc)
+    return ORJSONResponse(
+        {"success": False, "error": "Internal server error"}, status_code=500
     )
 
 
@@ -215,4 +284,6 @@ if __name__ == "__main__":
         port=settings.port,
         reload=settings.reload,
         log_level=settings.log_level.lower(),
+        loop="uvloop",
+        http="httptools",
     )
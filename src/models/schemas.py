@@ -3,7 +3,11 @@
 from enum import Enum
 from typing import Any
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+# Allowed diagram description length
+MIN_DESCRIPTION_LENGTH = 10
+MAX_DESCRIPTION_LENGTH = 2000
 
 
 class CloudProvider(str, Enum):
@@ -24,23 +28,34 @@ class DiagramDirection(str, Enum):
 class DiagramRequest(BaseModel):
     """Request model for diagram generation."""
 
-    description: str = Field(..., min_length=10, max_length=2000)
+    description: str = Field(
+        ..., min_length=MIN_DESCRIPTION_LENGTH, max_length=MAX_DESCRIPTION_LENGTH
+    )
     provider: CloudProvider | None = None
     direction: DiagramDirection = DiagramDirection.TOP_BOTTOM
 
-    @validator("description")
-    def validate_description(cls, v):
-        if not v.strip():
-            raise ValueError("Description cannot be empty")
-        return v.strip()
+    @field_validator("description", mode="before")
+    @classmethod
+    def strip_description(cls, v: Any) -> Any:
+        """Strip whitespace before the length limits are checked."""
+        return v.strip() if isinstance(v, str) else v
 
 
 class DiagramResponse(BaseModel):
     """Response model for diagram generation."""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     success: bool = True
     diagram_path: str
     generation_time_seconds: float
+    cache_key: str | None = None
+
+
+class BatchDiagramRequest(BaseModel):
+    """Request model for batch diagram generation."""
+
+    items: list[DiagramRequest] = Field(..., min_length=1, max_length=20)
 
 
 class AssistantRequest(BaseModel):
@@ -52,6 +67,8 @@ class AssistantRequest(BaseModel):
 class AssistantResponse(BaseModel):
     """Response model for assistant endpoint."""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     response: str
     diagram_url: str | None = None
 
@@ -59,14 +76,26 @@ class AssistantResponse(BaseModel):
 class ErrorResponse(BaseModel):
     """Error response model."""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     success: bool = False
     error: str
     details: dict[str, Any] | None = None
 
 
+class BatchDiagramResponse(BaseModel):
+    """Response model for batch diagram generation, in request order."""
+
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    results: list[DiagramResponse | ErrorResponse]
+
+
 class HealthResponse(BaseModel):
     """Health check response."""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     status: str = "healthy"
     timestamp: str
     version: str = "0.1.0"
@@ -1,18 +1,27 @@
 """Simplified diagram tools using the diagrams package."""
 
+import importlib
 import logging
+import os
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType, ModuleType
 
 from diagrams import Cluster, Diagram, Edge
 
+from src.config import get_settings
 from src.models.schemas import CloudProvider, DiagramDirection
+from src.tools.validators import normalize_service_name
 from src.utils.file_manager import file_manager
 
 logger = logging.getLogger(__name__)
 
 
 # Service mappings for cloud providers
-SERVICE_MAPPINGS = {
+SERVICE_MAPPINGS: dict[CloudProvider, dict[str, tuple[str, str]]] = {
     CloudProvider.AWS: {
         "ec2": ("diagrams.aws.compute", "EC2"),
         "lambda": ("diagrams.aws.compute", "Lambda"),
@@ -27,37 +36,96 @@ SERVICE_MAPPINGS = {
         "cloud_functions": ("diagrams.gcp.compute", "Functions"),
         "cloud_sql": ("diagrams.gcp.database", "SQL"),
         "cloud_storage": ("diagrams.gcp.storage", "Storage"),
-        "cloud_load_balancer": ("diagrams.gcp.network", "LoadBalancer"),
+        "cloud_load_balancer": ("diagrams.gcp.network", "LoadBalancing"),
     },
     CloudProvider.AZURE: {
         "vm": ("diagrams.azure.compute", "VM"),
         "functions": ("diagrams.azure.compute", "FunctionApps"),
         "sql_database": ("diagrams.azure.database", "SQLDatabases"),
         "blob_storage": ("diagrams.azure.storage", "BlobStorage"),
-        "load_balancer": ("diagrams.azure.network", "LoadBalancer"),
+        "load_balancer": ("diagrams.azure.network", "LoadBalancers"),
     },
 }
 
 
-def get_node_class(service: str, provider: CloudProvider):
-    """Get diagram node class for a service."""
-    service_key = service.lower().replace("-", "_").replace(" ", "_")
+@lru_cache(maxsize=256)
+def _node_class_key(provider: str, service: str) -> str:
+    """Get the interned _NODE_CLASSES key for a provider value and service name.
+
+    Table keys and lookup keys both come from here, so lookups match on
+    string identity without comparing characters.
+    """
+    return sys.intern(f"{provider}:{normalize_service_name(service)}")
+
 
-    if provider not in SERVICE_MAPPINGS:
-        raise ValueError(f"Unsupported provider: {provider}")
+def _resolve_node_classes() -> MappingProxyType[str, type]:
+    """Import every mapped node class once, keyed by "provider:service"."""
+    resolved: dict[str, type] = {}
+    modules: dict[str, ModuleType] = {}
+    for provider, provider_services in SERVICE_MAPPINGS.items():
+        for service_key, (module_path, class_name) in provider_services.items():
+            module = modules.get(module_path)
+            if module is None:
+                module = modules[module_path] = importlib.import_module(module_path)
+            key = _node_class_key(provider.value, service_key)
+            resolved[key] = getattr(module, class_name)
+    return MappingProxyType(resolved)
 
-    provider_services = SERVICE_MAPPINGS[provider]
-    if service_key not in provider_services:
-        available = list(provider_services.keys())
-        raise ValueError(f"Service '{service}' not found. Available: {available}")
 
-    module_path, class_name = provider_services[service_key]
+# Read-only node class table resolved at import time
+_NODE_CLASSES = _resolve_node_classes()
 
+
+def get_node_class(service: str, provider: CloudProvider) -> type:
+    """Get diagram node class for a service."""
     try:
-        module = __import__(module_path, fromlist=[class_name])
-        return getattr(module, class_name)
-    except (ImportError, AttributeError) as e:
-        raise ValueError(f"Failed to import {module_path}.{class_name}: {e}") from e
+        provider = CloudProvider(provider)
+    except ValueError:
+        raise ValueError(f"Unsupported provider: {provider}") from None
+
+    try:
+        return _NODE_CLASSES[_node_class_key(provider.value, service)]
+    except KeyError:
+        available = list(SERVICE_MAPPINGS[provider].keys())
+        raise ValueError(
+            f"Service '{service}' not found. Available: {available}"
+        ) from None
+
+
+def init_render_worker() -> None:
+    """Initialize a render worker process.
+
+    Node classes are resolved when this module is imported, which happens
+    when the worker unpickles this initializer. Settings are parsed once here
+    so every render in the worker reuses them.
+    """
+    get_settings()
+    logger.debug("Render worker ready with %s node classes", len(_NODE_CLASSES))
+
+
+@dataclass(slots=True)
+class DiagramNode:
+    """A node added to a diagram builder."""
+
+    node_class: type
+    label: str
+    cluster: str | None = None
+
+
+@dataclass(slots=True)
+class DiagramCluster:
+    """A cluster added to a diagram builder."""
+
+    label: str
+
+
+@dataclass(slots=True)
+class DiagramConnection:
+    """A connection between two builder nodes."""
+
+    source: str
+    target: str
+    label: str | None = None
 
 
 class DiagramBuilder:
@@ -65,12 +133,12 @@ class DiagramBuilder:
 
     def __init__(
         self, title: str, direction: DiagramDirection = DiagramDirection.TOP_BOTTOM
-    ):
+    ) -> None:
         self.title = title
         self.direction = direction
-        self.nodes = {}
-        self.clusters = {}
-        self.connections = []
+        self.nodes: dict[str, DiagramNode] = {}
+        self.clusters: dict[str, DiagramCluster] = {}
+        self.connections: list[DiagramConnection] = []
 
     def add_node(
         self,
@@ -78,24 +146,25 @@ class DiagramBuilder:
         service: str,
         provider: CloudProvider,
         label: str,
-        cluster: str = None,
-    ):
+        cluster: str | None = None,
+    ) -> None:
         """Add a node to the diagram."""
         node_class = get_node_class(service, provider)
-        self.nodes[node_id] = {"class": node_class, "label": label, "cluster": cluster}
+        self.nodes[node_id] = DiagramNode(node_class, label, cluster)
 
-    def add_cluster(self, cluster_id: str, label: str):
+    def add_cluster(self, cluster_id: str, label: str) -> None:
         """Add a cluster to the diagram."""
-        self.clusters[cluster_id] = {"label": label}
+        self.clusters[cluster_id] = DiagramCluster(label)
 
-    def connect_nodes(self, source: str, target: str, label: str = None):
+    def connect_nodes(self, source: str, target: str, label: str | None = None) -> None:
         """Connect two nodes."""
-        self.connections.append({"source": source, "target": target, "label": label})
+        self.connections.append(DiagramConnection(source, target, label))
 
-    def render(self) -> Path:
+    def render(self, output_path: Path | None = None) -> Path:
         """Render the diagram to a file."""
-        filename = file_manager.generate_filename("png")
-        output_path = file_manager.get_temp_path(filename)
+        if output_path is None:
+            filename = file_manager.generate_filename("png")
+            output_path = file_manager.get_temp_path(filename)
 
         with Diagram(
             self.title,
@@ -103,68 +172,145 @@ class DiagramBuilder:
             direction=self.direction.value,
             show=False,
         ):
-            # Create clusters
-            cluster_objects = {}
-            for cluster_id, cluster_data in self.clusters.items():
-                cluster_obj = Cluster(cluster_data["label"])
-                cluster_objects[cluster_id] = cluster_obj
-
-            # Create nodes
+            # Group nodes by cluster so each cluster is entered only once
+            clustered_nodes: defaultdict[str, list[tuple[str, DiagramNode]]] = (
+                defaultdict(list)
+            )
             node_objects = {}
             for node_id, node_data in self.nodes.items():
-                node_class = node_data["class"]
-                label = node_data["label"]
-                cluster = node_data.get("cluster")
-
-                if cluster and cluster in cluster_objects:
-                    with cluster_objects[cluster]:
-                        node_obj = node_class(label)
+                if node_data.cluster in self.clusters:
+                    clustered_nodes[node_data.cluster].append((node_id, node_data))
                 else:
-                    node_obj = node_class(label)
+                    node_objects[node_id] = node_data.node_class(node_data.label)
+
+            # Create clusters and their nodes
+            for cluster_id, cluster_data in self.clusters.items():
+                cluster_nodes = clustered_nodes.get(cluster_id)
+                if not cluster_nodes:
+                    continue
 
-                node_objects[node_id] = node_obj
+                with Cluster(cluster_data.label):
+                    for node_id, node_data in cluster_nodes:
+                        node_objects[node_id] = node_data.node_class(node_data.label)
 
             # Create connections
             for conn in self.connections:
-                source_obj = node_objects.get(conn["source"])
-                target_obj = node_objects.get(conn["target"])
+                source_obj = node_objects.get(conn.source)
+                target_obj = node_objects.get(conn.target)
 
                 if source_obj and target_obj:
-                    edge = Edge(label=conn.get("label"))
+                    edge = Edge(label=conn.label)
                     source_obj >> edge >> target_obj
 
         return output_path
 
 
+# Feature bits detected by the fallback heuristics
+FEATURE_WEB = 1 << 0
+FEATURE_DATABASE = 1 << 1
+FEATURE_LOAD_BALANCER = 1 << 2
+
+
+@lru_cache(maxsize=1024)
+def detect_features(description: str) -> int:
+    """Detect the infrastructure features mentioned in a description.
+
+    Memoized so the agent and the render worker, and repeated submissions
+    from different endpoints, scan each description only once per process.
+    """
+    description = description.lower()
+    mask = 0
+    if "web" in description:
+        mask |= FEATURE_WEB
+    if "database" in description or "db" in description:
+        mask |= FEATURE_DATABASE
+    if "load balancer" in description or "lb" in description:
+        mask |= FEATURE_LOAD_BALANCER
+    return mask
+
+
+def diagram_cache_key(
+    description: str,
+    provider: CloudProvider | None = None,
+    direction: DiagramDirection = DiagramDirection.TOP_BOTTOM,
+) -> str:
+    """Get the cache key for the diagram a request renders to.
+
+    The fallback heuristics only depend on the detected features, so every
+    description with the same features, provider and direction shares one
+    rendered template.
+    """
+    return _feature_cache_key(detect_features(description), provider, direction)
+
+
+# Lowercase direction codes used in cache keys
+_DIRECTION_KEYS = {direction: direction.value.lower() for direction in DiagramDirection}
+
+
+def _feature_cache_key(
+    features: int, provider: CloudProvider | None, direction: DiagramDirection
+) -> str:
+    """Build the cache key for an already detected feature mask."""
+    provider = provider or CloudProvider.AWS
+    return f"{provider.value}-{_DIRECTION_KEYS[direction]}-{features}"
+
+
+def diagram_cache_path(cache_key: str) -> Path:
+    """Get the temp file path a diagram with this cache key is rendered to."""
+    return file_manager.get_temp_path(f"diagram_{cache_key}.png")
+
+
 def create_diagram_from_description(
-    description: str, provider: CloudProvider = None
+    description: str,
+    provider: CloudProvider | None = None,
+    direction: DiagramDirection = DiagramDirection.TOP_BOTTOM,
 ) -> Path:
-    """Create a diagram from natural language description."""
+    """Create a diagram from natural language description.
+
+    Rendered diagrams are cached on disk under a name derived from
+    ``diagram_cache_key``, so repeated feature combinations skip Graphviz.
+    Each hit touches the file so cleanup keeps diagrams that are still in use,
+    and a render that fails never leaves a partial file under the cache name.
+    """
+    features = detect_features(description)
+    cache_key = _feature_cache_key(features, provider, direction)
+    output_path = diagram_cache_path(cache_key)
+    if file_manager.touch_file(output_path):
+        logger.debug("Diagram cache hit: %s", output_path)
+        return output_path
+
     # For now, create a simple fallback diagram
     # In the real implementation, this would use the LLM agent
 
-    builder = DiagramBuilder("Infrastructure Diagram")
+    builder = DiagramBuilder("Infrastructure Diagram", direction)
+    provider = provider or CloudProvider.AWS
 
     # Simple heuristics for demo
-    if "web" in description.lower():
+    if features & FEATURE_WEB:
         builder.add_cluster("web", "Web Tier")
-        builder.add_node(
-            "web1", "ec2", provider or CloudProvider.AWS, "Web Server", "web"
-        )
+        builder.add_node("web1", "ec2", provider, "Web Server", "web")
 
-    if "database" in description.lower() or "db" in description.lower():
+    if features & FEATURE_DATABASE:
         builder.add_cluster("data", "Data Tier")
-        builder.add_node(
-            "db1", "rds", provider or CloudProvider.AWS, "Database", "data"
-        )
+        builder.add_node("db1", "rds", provider, "Database", "data")
 
-        if "web1" in builder.nodes:
+        if features & FEATURE_WEB:
             builder.connect_nodes("web1", "db1", "queries")
 
-    if "load balancer" in description.lower() or "lb" in description.lower():
-        builder.add_node("lb1", "alb", provider or CloudProvider.AWS, "Load Balancer")
+    if features & FEATURE_LOAD_BALANCER:
+        builder.add_node("lb1", "alb", provider, "Load Balancer")
 
-        if "web1" in builder.nodes:
+        if features & FEATURE_WEB:
             builder.connect_nodes("lb1", "web1", "routes")
 
-    return builder.render()
+    # Render under a unique name and rename it into place, so a cache entry
+    # only ever appears once Graphviz has written the whole file
+    render_path = file_manager.get_temp_path(file_manager.generate_filename())
+    try:
+        builder.render(render_path)
+        os.replace(render_path, output_path)
+    except BaseException:
+        file_manager.delete_file(render_path)
+        raise
+
+    return output_path
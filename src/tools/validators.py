@@ -1,6 +1,23 @@
 """Simple validation utilities."""
 
 import re
+from functools import lru_cache
+
+from src.models.schemas import MAX_DESCRIPTION_LENGTH, MIN_DESCRIPTION_LENGTH
+
+# Markers of script injection in free-text input
+UNSAFE_CONTENT_RE = re.compile(r"<script|javascript:|(?:eval|exec)\s*\(", re.IGNORECASE)
+# Lowercased substrings of every ASCII UNSAFE_CONTENT_RE match
+_UNSAFE_KEYWORDS = ("<script", "javascript:", "eval", "exec")
+
+# Error messages for description length limits
+_DESCRIPTION_TOO_SHORT = (
+    f"Description must be at least {MIN_DESCRIPTION_LENGTH} characters"
+)
+_DESCRIPTION_TOO_LONG = f"Description cannot exceed {MAX_DESCRIPTION_LENGTH} characters"
+
+# Separators folded to underscores in service names
+_SERVICE_NAME_TRANS = str.maketrans("- ", "__")
 
 
 class ValidationError(Exception):
@@ -10,21 +27,33 @@ class ValidationError(Exception):
 
 
 def validate_description(description: str) -> None:
-    """Validate diagram description."""
-    if not description or len(description.strip()) < 10:
-        raise ValidationError("Description must be at least 10 characters")
+    """Validate an already stripped diagram description."""
+    if len(description) < MIN_DESCRIPTION_LENGTH:
+        raise ValidationError(_DESCRIPTION_TOO_SHORT)
 
-    if len(description) > 2000:
-        raise ValidationError("Description cannot exceed 2000 characters")
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        raise ValidationError(_DESCRIPTION_TOO_LONG)
 
-    # Check for suspicious content
-    if re.search(r"<script|javascript:|eval\(", description, re.IGNORECASE):
+    # Skip the regex when ASCII text has no keyword; non-ASCII text always
+    # runs it, since IGNORECASE folds characters like "ſ" that lower() keeps
+    if description.isascii():
+        lowered = description.lower()
+        if not any(keyword in lowered for keyword in _UNSAFE_KEYWORDS):
+            return
+
+    if UNSAFE_CONTENT_RE.search(description):
         raise ValidationError("Description contains unsafe content")
 
 
+@lru_cache(maxsize=1024)
+def normalize_service_name(service: str) -> str:
+    """Normalize a service name to its mapping key form."""
+    return service.translate(_SERVICE_NAME_TRANS).lower()
+
+
 def validate_service_name(service: str, available_services: list) -> str:
     """Validate and normalize service name."""
-    normalized = service.lower().replace("-", "_").replace(" ", "_")
+    normalized = normalize_service_name(service)
 
     if normalized not in available_services:
         raise ValidationError(
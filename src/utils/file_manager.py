@@ -1,15 +1,32 @@
 """File management utilities for temporary diagram files."""
 
 import asyncio
+import itertools
 import logging
+import os
+import secrets
+import stat
 import time
 from pathlib import Path
-from uuid import uuid4
 
-from src.config import settings
+from src.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Filenames are a random per-process prefix plus a counter
+_filename_prefix = secrets.token_hex(8)
+_filename_counter = itertools.count()
+
+
+def _reset_filename_sequence() -> None:
+    """Give a forked process its own filename prefix."""
+    global _filename_prefix, _filename_counter
+    _filename_prefix = secrets.token_hex(8)
+    _filename_counter = itertools.count()
+
+
+os.register_at_fork(after_in_child=_reset_filename_sequence)
+
 
 class FileManager:
     """Manages temporary files for diagram generation."""
@@ -18,10 +35,24 @@ class FileManager:
         """Initialize the file manager.
 
         Args:
-            temp_dir: Directory for temporary files. Uses settings.temp_dir if None.
+            temp_dir: Directory for temporary files. Uses settings.temp_dir,
+                resolved on first use, if None.
         """
-        self.temp_dir = temp_dir or settings.temp_dir
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self._temp_dir = temp_dir
+        if temp_dir is not None:
+            temp_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def temp_dir(self) -> Path:
+        """Directory for temporary files, created when first resolved."""
+        if self._temp_dir is None:
+            self._temp_dir = get_settings().temp_dir
+            self._temp_dir.mkdir(parents=True, exist_ok=True)
+        return self._temp_dir
+
+    @temp_dir.setter
+    def temp_dir(self, temp_dir: Path) -> None:
+        self._temp_dir = temp_dir
 
     def generate_filename(self, extension: str = "png") -> str:
         """Generate a unique filename.
@@ -32,8 +63,7 @@ class FileManager:
         Returns:
             Unique filename with extension
         """
-        unique_id = str(uuid4())
-        return f"diagram_{unique_id}.{extension}"
+        return f"diagram_{_filename_prefix}_{next(_filename_counter):x}.{extension}"
 
     def get_temp_path(self, filename: str | None = None) -> Path:
         """Get a temporary file path.
@@ -49,6 +79,41 @@ class FileManager:
 
         return self.temp_dir / filename
 
+    def stat_file(self, file_path: Path) -> os.stat_result | None:
+        """Get the stat result of a regular file.
+
+        Args:
+            file_path: Path to file
+
+        Returns:
+            Stat result, or None if the path is not an existing regular file
+        """
+        try:
+            stat_result = file_path.stat()
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        return stat_result
+
+    def touch_file(self, file_path: Path) -> bool:
+        """Mark a file as just used so cleanup keeps it for another full age.
+
+        Only the access time moves; the modification time, and the ETag
+        derived from it, still reflect when the file was written.
+
+        Args:
+            file_path: Path to file
+
+        Returns:
+            True if the file exists and was touched
+        """
+        try:
+            os.utime(file_path, ns=(time.time_ns(), file_path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            return False
+        return True
+
     def create_temp_file(self, content: bytes, extension: str = "png") -> Path:
         """Create a temporary file with content.
 
@@ -65,11 +130,11 @@ class FileManager:
         with file_path.open("wb") as f:
             f.write(content)
 
-        logger.debug(f"Created temporary file: {file_path}")
+        logger.debug("Created temporary file: %s", file_path)
         return file_path
 
     def cleanup_old_files(self, max_age_minutes: int | None = None) -> int:
-        """Clean up old temporary files.
+        """Clean up temporary files not written or touched recently.
 
         Args:
             max_age_minutes: Maximum age in minutes. Uses settings value if None.
@@ -78,33 +143,58 @@ class FileManager:
             Number of files cleaned up
         """
         if max_age_minutes is None:
-            max_age_minutes = settings.max_file_age_minutes
+            max_age_minutes = get_settings().max_file_age_minutes
+
+        cleaned_count, _ = self._sweep(max_age_minutes * 60)
+        return cleaned_count
 
-        max_age_seconds = max_age_minutes * 60
+    def _sweep(self, max_age_seconds: float) -> tuple[int, float | None]:
+        """Delete expired files and find when the next remaining one expires.
+
+        Args:
+            max_age_seconds: Maximum file age in seconds
+
+        Returns:
+            Number of files cleaned up, and the earliest expiry time of the
+            remaining files or None if there are none
+        """
         current_time = time.time()
         cleaned_count = 0
+        next_expiry = None
 
         try:
-            for file_path in self.temp_dir.iterdir():
-                if not file_path.is_file():
-                    continue
+            # scandir entries carry the file type, so only mtime needs a stat
+            with os.scandir(self.temp_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
 
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > max_age_seconds:
                     try:
-                        file_path.unlink()
-                        cleaned_count += 1
-                        logger.debug(f"Cleaned up old file: {file_path}")
-                    except OSError as e:
-                        logger.warning(f"Failed to delete {file_path}: {e}")
+                        entry_stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+                    # Age from the last write or touch_file, whichever is later
+                    last_used = max(entry_stat.st_mtime, entry_stat.st_atime)
+                    expiry = last_used + max_age_seconds
+
+                    if expiry < current_time:
+                        try:
+                            os.unlink(entry.path)
+                            cleaned_count += 1
+                            logger.debug("Cleaned up old file: %s", entry.path)
+                        except OSError as e:
+                            logger.warning("Failed to delete %s: %s", entry.path, e)
+                    elif next_expiry is None or expiry < next_expiry:
+                        next_expiry = expiry
 
         except OSError as e:
-            logger.error(f"Error during cleanup: {e}")
+            logger.error("Error during cleanup: %s", e)
 
         if cleaned_count > 0:
-            logger.info(f"Cleaned up {cleaned_count} old temporary files")
+            logger.info("Cleaned up %s old temporary files", cleaned_count)
 
-        return cleaned_count
+        return cleaned_count, next_expiry
 
     def delete_file(self, file_path: Path) -> bool:
         """Delete a specific file.
@@ -116,15 +206,16 @@ class FileManager:
             True if file was deleted successfully
         """
         try:
-            if file_path.exists():
-                file_path.unlink()
-                logger.debug(f"Deleted file: {file_path}")
-                return True
+            file_path.unlink()
+        except FileNotFoundError:
             return False
         except OSError as e:
-            logger.warning(f"Failed to delete {file_path}: {e}")
+            logger.warning("Failed to delete %s: %s", file_path, e)
             return False
 
+        logger.debug("Deleted file: %s", file_path)
+        return True
+
     def get_file_size(self, file_path: Path) -> int | None:
         """Get file size in bytes.
 
@@ -146,20 +237,30 @@ class FileManager:
     async def cleanup_periodically(self, interval_minutes: int = 30) -> None:
         """Periodically clean up old files.
 
+        Sweeps run in a worker thread so directory scans never block the
+        event loop. After each sweep the task sleeps until the oldest
+        remaining file expires, or at most ``interval_minutes``.
+
         Args:
-            interval_minutes: Cleanup interval in minutes
+            interval_minutes: Maximum time between sweeps in minutes
         """
         interval_seconds = interval_minutes * 60
+        delay = float(interval_seconds)
 
         while True:
             try:
-                await asyncio.sleep(interval_seconds)
-                self.cleanup_old_files()
+                await asyncio.sleep(delay)
+                max_age_seconds = get_settings().max_file_age_minutes * 60
+                _, next_expiry = await asyncio.to_thread(self._sweep, max_age_seconds)
+
+                delay = interval_seconds
+                if next_expiry is not None:
+                    delay = min(delay, max(next_expiry - time.time(), 1))
             except asyncio.CancelledError:
                 logger.info("Periodic cleanup task cancelled")
                 break
             except Exception as e:
-                logger.error(f"Error in periodic cleanup: {e}")
+                logger.error("Error in periodic cleanup: %s", e)
 
 
 # Global file manager instance
@@ -0,0 +1,30 @@
+"""Shared test fixtures."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.main import app
+from src.models.schemas import CloudProvider, DiagramRequest
+from src.utils.file_manager import file_manager
+
+
+@pytest.fixture(autouse=True)
+def isolated_temp_dir(monkeypatch, tmp_path):
+    """Render into a per-test directory so cached diagrams never leak."""
+    monkeypatch.setattr(file_manager, "temp_dir", tmp_path)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Provide one started test client for the whole session."""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def sample_request():
+    """Provide one validated diagram request; tests must not mutate it."""
+    return DiagramRequest(
+        description="A microservices architecture with API gateway",
+        provider=CloudProvider.AWS,
+    )
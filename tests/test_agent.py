@@ -1,30 +1,47 @@
 """Simplified tests for diagram agent."""
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from unittest.mock import AsyncMock, patch
+from unittest.mock import Mock, patch
 
 import pytest
 
-from src.agents.diagram_agent import DiagramAgent, generate_diagram
+from src.agents.diagram_agent import DiagramAgent
 from src.models.schemas import (
     CloudProvider,
+    DiagramDirection,
     DiagramRequest,
     DiagramResponse,
     ErrorResponse,
 )
+from src.tools.diagram_tools import diagram_cache_key, diagram_cache_path
+
+_TMP_TEST_PNG = Path("/tmp/test.png")
+_TMP_SHARED_PNG = Path("/tmp/shared.png")
+_TMP_MOCK_PNG = Path("/tmp/mock.png")
+_TMP_POOLED_PNG = Path("/tmp/pooled.png")
+
+
+@pytest.fixture
+def mock_settings():
+    """Patch the agent settings with mock mode enabled."""
+    with patch("src.agents.diagram_agent.get_settings") as mock_get_settings:
+        settings = mock_get_settings.return_value
+        settings.mock_mode = True
+        settings.max_concurrent_renders = 8
+        yield settings
 
 
 class TestDiagramAgent:
     """Test the diagram agent."""
 
-    @patch("src.agents.diagram_agent.settings")
     def test_init_mock_mode(self, mock_settings):
         """Test agent initialization in mock mode."""
-        mock_settings.mock_mode = True
         agent = DiagramAgent()
         assert agent.model is None
 
-    @patch("src.agents.diagram_agent.settings")
     @patch("src.agents.diagram_agent.genai")
     def test_init_real_mode(self, mock_genai, mock_settings):
         """Test agent initialization with Gemini."""
@@ -35,24 +52,74 @@ class TestDiagramAgent:
 
         mock_genai.configure.assert_called_once_with(api_key="test-key")
 
-    @pytest.mark.asyncio
-    @patch("src.agents.diagram_agent.settings")
     async def test_generate_diagram_mock_mode(self, mock_settings):
         """Test diagram generation in mock mode."""
-        mock_settings.mock_mode = True
         agent = DiagramAgent()
 
         with patch.object(agent, "_create_mock_diagram") as mock_create:
-            mock_create.return_value = Path("/tmp/test.png")
+            mock_create.return_value = _TMP_TEST_PNG
 
             request = DiagramRequest(description="A web application")
             response = await agent.generate_diagram(request)
 
             assert isinstance(response, DiagramResponse)
             assert response.success is True
-            assert response.diagram_path == "/tmp/test.png"
+            assert response.diagram_path == str(_TMP_TEST_PNG)
+
+    async def test_generate_diagram_coalesces_identical_requests(self, mock_settings):
+        """Test concurrent identical requests share a single render."""
+        agent = DiagramAgent()
+
+        async def slow_render(request):
+            await asyncio.sleep(0.01)
+            return _TMP_SHARED_PNG
+
+        with patch.object(
+            agent, "_create_mock_diagram", side_effect=slow_render
+        ) as mock_create:
+            request = DiagramRequest(description="A web application")
+            first, second = await asyncio.gather(
+                agent.generate_diagram(request), agent.generate_diagram(request)
+            )
+
+        assert mock_create.await_count == 1
+        assert first.diagram_path == second.diagram_path == str(_TMP_SHARED_PNG)
+        assert agent._inflight == {}
+
+    async def test_generate_diagram_joins_render_in_flight(self, mock_settings):
+        """Test a partial file from a running render is not taken as a hit."""
+        agent = DiagramAgent()
+        request = DiagramRequest(description="A web application")
+        render_started = asyncio.Event()
+        finish_render = asyncio.Event()
+
+        async def slow_render(request):
+            render_started.set()
+            await finish_render.wait()
+            return _TMP_SHARED_PNG
+
+        with patch.object(
+            agent, "_create_mock_diagram", side_effect=slow_render
+        ) as mock_create:
+            first = asyncio.create_task(agent.generate_diagram(request))
+            await render_started.wait()
+            cache_key = diagram_cache_key(
+                request.description, request.provider, request.direction
+            )
+            diagram_cache_path(cache_key).write_bytes(b"")
+
+            second = asyncio.create_task(agent.generate_diagram(request))
+            await asyncio.sleep(0)
+            assert not second.done()
+
+            finish_render.set()
+            responses = await asyncio.gather(first, second)
+
+        assert mock_create.await_count == 1
+        assert [response.diagram_path for response in responses] == [
+            str(_TMP_SHARED_PNG)
+        ] * 2
 
-    @pytest.mark.asyncio
     async def test_generate_diagram_validation_error(self):
         """Test validation error handling."""
         agent = DiagramAgent()
@@ -65,47 +132,74 @@ class TestDiagramAgent:
         assert "at least 10 characters" in response.error
 
     @patch("src.agents.diagram_agent.create_diagram_from_description")
-    def test_create_mock_diagram(self, mock_create):
+    async def test_create_mock_diagram(self, mock_create):
         """Test mock diagram creation."""
-        mock_create.return_value = Path("/tmp/mock.png")
+        mock_create.return_value = _TMP_MOCK_PNG
         agent = DiagramAgent()
 
         request = DiagramRequest(description="Test diagram", provider=CloudProvider.AWS)
-        result = agent._create_mock_diagram(request)
-
-        assert result == Path("/tmp/mock.png")
-        mock_create.assert_called_once_with("Test diagram", CloudProvider.AWS)
+        result = await agent._create_mock_diagram(request)
 
+        assert result == _TMP_MOCK_PNG
+        mock_create.assert_called_once_with(
+            "Test diagram", CloudProvider.AWS, DiagramDirection.TOP_BOTTOM
+        )
 
-class TestGlobalFunctions:
-    """Test global utility functions."""
+    @patch("src.agents.diagram_agent.create_diagram_from_description")
+    async def test_render_uses_render_pool(self, mock_create):
+        """Test rendering is submitted to the configured render pool."""
+        mock_create.return_value = _TMP_POOLED_PNG
+        render_pool = Mock(wraps=ThreadPoolExecutor(max_workers=1))
+        agent = DiagramAgent(render_pool=render_pool)
 
-    @pytest.mark.asyncio
-    @patch("src.agents.diagram_agent._agent", None)
-    async def test_get_agent(self):
-        """Test getting the global agent instance."""
-        from src.agents.diagram_agent import get_agent
+        request = DiagramRequest(description="Test diagram")
+        result = await agent._render(request)
 
-        agent = await get_agent()
-        assert agent is not None
-        assert isinstance(agent, DiagramAgent)
+        assert result == _TMP_POOLED_PNG
+        render_pool.submit.assert_called_once()
 
-    @pytest.mark.asyncio
-    @patch("src.agents.diagram_agent.get_agent")
-    async def test_generate_diagram_function(self, mock_get_agent):
-        """Test the global generate_diagram function."""
-        mock_agent = AsyncMock()
-        mock_response = DiagramResponse(
-            diagram_path="/tmp/test.png", generation_time_seconds=1.0
+    async def test_generate_diagram_cache_hit(self, mock_settings):
+        """Test cached diagrams skip the render slots and the render pool."""
+        request = DiagramRequest(description="Web app with a database")
+        cached_path = diagram_cache_path(
+            diagram_cache_key(request.description, request.provider, request.direction)
         )
-        mock_agent.generate_diagram.return_value = mock_response
-        mock_get_agent.return_value = mock_agent
+        cached_path.write_bytes(b"png")
+        mock_settings.max_concurrent_renders = 1
+        render_pool = Mock()
+        agent = DiagramAgent(render_pool=render_pool)
 
-        request = DiagramRequest(description="Test diagram")
-        result = await generate_diagram(request)
+        # Hold the only render slot; a hit must not wait for it
+        async with agent._render_slots:
+            response = await asyncio.wait_for(agent.generate_diagram(request), 1)
+
+        assert isinstance(response, DiagramResponse)
+        assert response.diagram_path == str(cached_path)
+        render_pool.submit.assert_not_called()
+
+    @patch("src.agents.diagram_agent.create_diagram_from_description")
+    async def test_render_limits_concurrency(self, mock_create, mock_settings):
+        """Test no more than max_concurrent_renders renders run at once."""
+        mock_settings.max_concurrent_renders = 1
+        active = []
+        peak = []
+
+        def render(description, provider, direction):
+            active.append(description)
+            peak.append(len(active))
+            time.sleep(0.01)
+            active.remove(description)
+            return Path(f"/tmp/{description}.png")
+
+        mock_create.side_effect = render
+        agent = DiagramAgent(render_pool=ThreadPoolExecutor(max_workers=2))
+
+        await asyncio.gather(
+            agent._render(DiagramRequest(description="first diagram")),
+            agent._render(DiagramRequest(description="second diagram")),
+        )
 
-        assert result == mock_response
-        mock_agent.generate_diagram.assert_called_once_with(request)
+        assert max(peak) == 1
 
 
 if __name__ == "__main__":
@@ -1,21 +1,41 @@
 """Tests for FastAPI endpoints."""
 
-from pathlib import Path
-from unittest.mock import patch
+import asyncio
+from unittest.mock import AsyncMock
 
 import pytest
-from fastapi.testclient import TestClient
 
-from src.main import app
-from src.models.schemas import DiagramResponse, ErrorResponse
+from src.agents.diagram_agent import DiagramAgent
+from src.main import app, generate_diagram_batch_endpoint
+from src.models.schemas import (
+    BatchDiagramRequest,
+    DiagramRequest,
+    DiagramResponse,
+    ErrorResponse,
+)
+from src.utils.file_manager import file_manager
 
-client = TestClient(app)
+
+@pytest.fixture
+def mock_agent(monkeypatch):
+    """Install a mock diagram agent on the application state."""
+    agent = AsyncMock(spec=DiagramAgent)
+    monkeypatch.setattr(app.state, "agent", agent, raising=False)
+    return agent
+
+
+@pytest.fixture
+def served_png(tmp_path):
+    """Write a diagram into the temp dir for the download endpoint to serve."""
+    file_path = tmp_path / "test.png"
+    file_path.write_bytes(b"png")
+    return file_path
 
 
 class TestHealthEndpoint:
     """Test health check endpoint."""
 
-    def test_health_check(self):
+    def test_health_check(self, client):
         """Test health endpoint returns correct format."""
         response = client.get("/health")
 
@@ -29,13 +49,12 @@ class TestHealthEndpoint:
 class TestDiagramEndpoint:
     """Test diagram generation endpoint."""
 
-    @patch("src.main.generate_diagram")
-    def test_generate_diagram_success(self, mock_generate):
+    def test_generate_diagram_success(self, client, mock_agent):
         """Test successful diagram generation."""
         mock_response = DiagramResponse(
             diagram_path="/tmp/test.png", generation_time_seconds=1.5
         )
-        mock_generate.return_value = mock_response
+        mock_agent.generate_diagram.return_value = mock_response
 
         response = client.post(
             "/generate-diagram", json={"description": "A web application with database"}
@@ -47,10 +66,9 @@ class TestDiagramEndpoint:
         assert data["diagram_path"] == "/tmp/test.png"
         assert data["generation_time_seconds"] == 1.5
 
-    @patch("src.main.generate_diagram")
-    def test_generate_diagram_validation_error(self, mock_generate):
+    def test_generate_diagram_validation_error(self, client, mock_agent):
         """Test validation error handling."""
-        mock_generate.return_value = ErrorResponse(
+        mock_agent.generate_diagram.return_value = ErrorResponse(
             error="Description must be at least 10 characters"
         )
 
@@ -59,16 +77,15 @@ class TestDiagramEndpoint:
         assert response.status_code == 400
         assert "at least 10 characters" in response.json()["detail"]
 
-    def test_generate_diagram_invalid_request(self):
+    def test_generate_diagram_invalid_request(self, client):
         """Test invalid request format."""
         response = client.post("/generate-diagram", json={"invalid": "field"})
 
         assert response.status_code == 422  # Validation error
 
-    @patch("src.main.generate_diagram")
-    def test_generate_diagram_server_error(self, mock_generate):
+    def test_generate_diagram_server_error(self, client, mock_agent):
         """Test server error handling."""
-        mock_generate.side_effect = Exception("Server error")
+        mock_agent.generate_diagram.side_effect = Exception("Server error")
 
         response = client.post(
             "/generate-diagram", json={"description": "A web application with database"}
@@ -78,33 +95,156 @@ class TestDiagramEndpoint:
         assert "Server error" in response.json()["detail"]
 
 
+class TestBatchEndpoint:
+    """Test batch diagram generation endpoint."""
+
+    def test_generate_batch_preserves_order_and_errors(self, client, mock_agent):
+        """Test each item gets a result, with failures reported in place."""
+        mock_agent.generate_diagram.side_effect = [
+            DiagramResponse(diagram_path="/tmp/one.png", generation_time_seconds=1.0),
+            Exception("Render failed"),
+        ]
+
+        response = client.post(
+            "/generate-diagram/batch",
+            json={
+                "items": [
+                    {"description": "A web application with database"},
+                    {"description": "A load balancer in front of web servers"},
+                ]
+            },
+        )
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["diagram_path"] == "/tmp/one.png"
+        assert results[1] == {
+            "success": False,
+            "error": "Render failed",
+            "details": None,
+        }
+
+    def test_generate_batch_gzipped(self, client, mock_agent):
+        """Test larger JSON responses are gzip-compressed."""
+        mock_agent.generate_diagram.return_value = DiagramResponse(
+            diagram_path="/tmp/one.png", generation_time_seconds=1.0
+        )
+
+        response = client.post(
+            "/generate-diagram/batch",
+            json={"items": [{"description": "A web application with database"}] * 5},
+            headers={"Accept-Encoding": "gzip"},
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.json()["results"]) == 5
+
+    async def test_generate_batch_cancelled(self, mock_agent):
+        """Test a cancelled item cancels the batch instead of being reported."""
+        mock_agent.generate_diagram.side_effect = asyncio.CancelledError
+        request = BatchDiagramRequest(
+            items=[DiagramRequest(description="A web application with database")]
+        )
+
+        with pytest.raises(asyncio.CancelledError):
+            await generate_diagram_batch_endpoint(request)
+
+    def test_generate_batch_empty(self, client):
+        """Test an empty batch is rejected."""
+        response = client.post("/generate-diagram/batch", json={"items": []})
+
+        assert response.status_code == 422
+
+
+class TestLifecycle:
+    """Test application startup and shutdown."""
+
+    def test_startup_creates_agent(self, client):
+        """Test the diagram agent is constructed once at startup."""
+        assert isinstance(app.state.agent, DiagramAgent)
+        assert app.state.agent.render_pool is app.state.render_pool
+
+
 class TestFileServing:
     """Test diagram file serving."""
 
-    @patch("src.main.file_manager.get_temp_path")
-    @patch("pathlib.Path.exists")
-    def test_get_diagram_success(self, mock_exists, mock_get_path):
+    def test_get_diagram_success(self, client, served_png):
         """Test successful diagram file serving."""
-        mock_path = Path("/tmp/test.png")
-        mock_get_path.return_value = mock_path
-        mock_exists.return_value = True
+        response = client.get("/diagrams/test.png")
 
-        with patch("src.main.FileResponse") as mock_file_response:
-            mock_file_response.return_value = "file_content"
+        assert response.status_code == 200
+        assert response.content == b"png"
+        assert response.headers["cache-control"] == "public, max-age=300"
+        assert response.headers["etag"]
 
-            client.get("/diagrams/test.png")
+    def test_get_diagram_deleted(self, client, served_png):
+        """Test a diagram deleted after being served returns 404."""
+        assert client.get("/diagrams/test.png").status_code == 200
+        assert file_manager.delete_file(served_png)
 
-            # Note: This test is simplified since FileResponse is hard to mock properly
-            mock_get_path.assert_called_once_with("test.png")
+        assert client.get("/diagrams/test.png").status_code == 404
 
-    @patch("src.main.file_manager.get_temp_path")
-    @patch("pathlib.Path.exists")
-    def test_get_diagram_not_found(self, mock_exists, mock_get_path):
-        """Test diagram file not found."""
-        mock_path = Path("/tmp/test.png")
-        mock_get_path.return_value = mock_path
-        mock_exists.return_value = False
+    def test_get_diagram_not_gzipped(self, client, served_png):
+        """Test PNG downloads are sent without content encoding."""
+        served_png.write_bytes(b"png" * 1000)
 
+        response = client.get("/diagrams/test.png", headers={"Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+
+    def test_get_diagram_accel_redirect(self, client, served_png, monkeypatch):
+        """Test downloads are delegated to the proxy when configured."""
+        monkeypatch.setattr(
+            "src.main.settings.accel_redirect_prefix", "/internal-diagrams/"
+        )
+
+        response = client.get("/diagrams/test.png")
+
+        assert response.status_code == 200
+        assert response.content == b""
+        assert response.headers["x-accel-redirect"] == "/internal-diagrams/test.png"
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["cache-control"] == "public, max-age=300"
+        assert response.headers["content-disposition"] == (
+            'attachment; filename="test.png"'
+        )
+
+    def test_get_diagram_accel_redirect_matches_file_response(
+        self, client, tmp_path, monkeypatch
+    ):
+        """Test non-ASCII names are percent-encoded like FileResponse does."""
+        (tmp_path / "schéma.png").write_bytes(b"png")
+        direct = client.get("/diagrams/sch%C3%A9ma.png")
+        monkeypatch.setattr(
+            "src.main.settings.accel_redirect_prefix", "/internal-diagrams/"
+        )
+
+        response = client.get("/diagrams/sch%C3%A9ma.png")
+
+        assert response.headers["x-accel-redirect"] == (
+            "/internal-diagrams/sch%C3%A9ma.png"
+        )
+        assert response.headers["content-disposition"] == (
+            "attachment; filename*=utf-8''sch%C3%A9ma.png"
+        )
+        assert (
+            response.headers["content-disposition"]
+            == direct.headers["content-disposition"]
+        )
+
+    def test_get_diagram_not_modified(self, client, served_png):
+        """Test a matching If-None-Match returns 304 without a body."""
+        etag = client.get("/diagrams/test.png").headers["etag"]
+
+        response = client.get("/diagrams/test.png", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_get_diagram_not_found(self, client):
+        """Test diagram file not found."""
         response = client.get("/diagrams/nonexistent.png")
 
         assert response.status_code == 404
@@ -114,13 +254,12 @@ class TestFileServing:
 class TestAssistantEndpoint:
     """Test assistant chat endpoint."""
 
-    @patch("src.main.generate_diagram")
-    def test_assistant_diagram_request(self, mock_generate):
+    def test_assistant_diagram_request(self, client, mock_agent):
         """Test assistant endpoint for diagram requests."""
         mock_response = DiagramResponse(
             diagram_path="/tmp/diagram_abc123.png", generation_time_seconds=2.0
         )
-        mock_generate.return_value = mock_response
+        mock_agent.generate_diagram.return_value = mock_response
 
         response = client.post(
             "/assistant", json={"message": "Create a diagram for a web application"}
@@ -131,7 +270,20 @@ class TestAssistantEndpoint:
         assert "created an infrastructure diagram" in data["response"]
         assert data["diagram_url"] == "/diagrams/diagram_abc123.png"
 
-    def test_assistant_general_request(self):
+    def test_assistant_extracts_description(self, client, mock_agent):
+        """Test the text after "diagram" is used as the description."""
+        mock_agent.generate_diagram.return_value = DiagramResponse(
+            diagram_path="/tmp/diagram_abc123.png", generation_time_seconds=2.0
+        )
+
+        client.post(
+            "/assistant", json={"message": "Draw a diagram of: Web app with database"}
+        )
+
+        diagram_request = mock_agent.generate_diagram.call_args.args[0]
+        assert diagram_request.description == "Web app with database"
+
+    def test_assistant_general_request(self, client):
         """Test assistant endpoint for general requests."""
         response = client.post("/assistant", json={"message": "Hello, how are you?"})
 
@@ -140,10 +292,11 @@ class TestAssistantEndpoint:
         assert "diagram architect assistant" in data["response"]
         assert data["diagram_url"] is None
 
-    @patch("src.main.generate_diagram")
-    def test_assistant_diagram_error(self, mock_generate):
+    def test_assistant_diagram_error(self, client, mock_agent):
         """Test assistant handling of diagram generation errors."""
-        mock_generate.return_value = ErrorResponse(error="Generation failed")
+        mock_agent.generate_diagram.return_value = ErrorResponse(
+            error="Generation failed"
+        )
 
         response = client.post(
             "/assistant", json={"message": "Create a diagram for something"}
@@ -154,7 +307,7 @@ class TestAssistantEndpoint:
         assert "couldn't generate the diagram" in data["response"]
         assert data["diagram_url"] is None
 
-    def test_assistant_invalid_request(self):
+    def test_assistant_invalid_request(self, client):
         """Test assistant endpoint with invalid request."""
         response = client.post("/assistant", json={"invalid": "field"})
 
@@ -164,7 +317,7 @@ class TestAssistantEndpoint:
 class TestErrorHandlers:
     """Test global error handlers."""
 
-    def test_404_handler(self):
+    def test_404_handler(self, client):
         """Test 404 error handler."""
         response = client.get("/nonexistent-endpoint")
 
@@ -177,7 +330,7 @@ class TestErrorHandlers:
 class TestCORS:
     """Test CORS configuration."""
 
-    def test_cors_preflight(self):
+    def test_cors_preflight(self, client):
         """Test CORS preflight request."""
         response = client.options(
             "/generate-diagram",
@@ -0,0 +1,97 @@
+"""Tests for temporary file management."""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from src.config import get_settings
+from src.utils.file_manager import FileManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """Provide a file manager over an empty directory with a one-hour max age."""
+    monkeypatch.setattr(get_settings(), "max_file_age_minutes", 60)
+    return FileManager(tmp_path)
+
+
+def write_aged(path, age_seconds):
+    """Write a file last written and used ``age_seconds`` ago."""
+    path.write_bytes(b"png")
+    used_at = time.time() - age_seconds
+    os.utime(path, (used_at, used_at))
+    return path
+
+
+@pytest.fixture
+def recorded_sleeps(monkeypatch):
+    """Record cleanup sleeps, cancelling the task on its second sleep."""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        if len(delays) == 2:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    return delays
+
+
+class TestSweep:
+    """Test expired file cleanup."""
+
+    def test_cleanup_removes_only_expired_files(self, manager, tmp_path):
+        """Test expired diagrams are removed and everything else is kept."""
+        expired = write_aged(tmp_path / "diagram_expired.png", 2 * 3600)
+        fresh = write_aged(tmp_path / "diagram_fresh.png", 60)
+        old_dir = tmp_path / "diagram_dir.png"
+        old_dir.mkdir()
+        os.utime(old_dir, (0, 0))
+
+        assert manager.cleanup_old_files() == 1
+
+        assert not expired.exists()
+        assert fresh.exists()
+        assert old_dir.is_dir()
+
+    def test_sweep_reports_next_expiry(self, manager, tmp_path):
+        """Test the sweep returns when the oldest remaining file expires."""
+        write_aged(tmp_path / "diagram_soon.png", 3600 - 120)
+        write_aged(tmp_path / "diagram_later.png", 60)
+
+        _, next_expiry = manager._sweep(3600)
+
+        assert next_expiry == pytest.approx(time.time() + 120, abs=5)
+
+    def test_sweep_empty_dir(self, manager):
+        """Test an empty directory has no next expiry."""
+        assert manager._sweep(3600) == (0, None)
+
+
+class TestCleanupPeriodically:
+    """Test periodic cleanup scheduling."""
+
+    async def test_sleeps_until_next_expiry(self, manager, tmp_path, recorded_sleeps):
+        """Test the sleep after a sweep is clamped to the next file expiry."""
+        write_aged(tmp_path / "diagram_soon.png", 3600 - 120)
+
+        await manager.cleanup_periodically(interval_minutes=30)
+
+        assert recorded_sleeps[0] == 30 * 60
+        assert recorded_sleeps[1] == pytest.approx(120, abs=5)
+
+    async def test_sleeps_full_interval_without_files(self, manager, recorded_sleeps):
+        """Test the task sleeps the whole interval when nothing can expire."""
+        await manager.cleanup_periodically(interval_minutes=30)
+
+        assert recorded_sleeps == [30 * 60, 30 * 60]
+
+    async def test_sleeps_at_least_one_second(self, manager, tmp_path, recorded_sleeps):
+        """Test a file expiring during the sweep cannot cause a busy loop."""
+        write_aged(tmp_path / "diagram_now.png", 3600 - 0.5)
+
+        await manager.cleanup_periodically(interval_minutes=30)
+
+        assert recorded_sleeps[1] == 1
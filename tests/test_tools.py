@@ -1,40 +1,82 @@
 """Simplified tests for diagram tools."""
 
-from unittest.mock import MagicMock, patch
+import os
+import re
+import time
+from unittest.mock import Mock, patch
 
 import pytest
 
-from src.models.schemas import CloudProvider
+from src.models.schemas import CloudProvider, DiagramDirection
+from src.tools import diagram_tools
 from src.tools.diagram_tools import (
     DiagramBuilder,
     create_diagram_from_description,
+    diagram_cache_key,
     get_node_class,
 )
+from src.tools.validators import (
+    ValidationError,
+    normalize_service_name,
+    validate_description,
+)
+from src.utils.file_manager import file_manager
+
+_RE_SERVICE_NOT_FOUND = re.compile("Service 'invalid' not found")
+_RE_UNSUPPORTED_PROVIDER = re.compile("Unsupported provider")
+_RE_TOO_SHORT = re.compile("at least 10 characters")
+_RE_TOO_LONG = re.compile("cannot exceed 2000 characters")
+_RE_UNSAFE = re.compile("unsafe content")
+
+
+class FakeNode:
+    """Stand-in node class for builder tests that never render."""
+
+
+@pytest.fixture
+def builder():
+    """Provide an empty diagram builder."""
+    return DiagramBuilder("Test")
+
+
+@pytest.fixture
+def mock_builder(monkeypatch):
+    """Replace DiagramBuilder with a Mock whose render writes a stub PNG."""
+    mock_builder = Mock(render=Mock(side_effect=lambda path: path.write_bytes(b"png")))
+    monkeypatch.setattr(
+        diagram_tools, "DiagramBuilder", Mock(return_value=mock_builder)
+    )
+    return mock_builder
 
 
 class TestServiceMapping:
     """Test service mapping functionality."""
 
-    @patch("src.tools.diagram_tools.__import__")
-    def test_get_node_class_success(self, mock_import):
+    def test_get_node_class_success(self):
         """Test successful node class retrieval."""
-        mock_module = MagicMock()
-        mock_ec2_class = MagicMock()
-        mock_module.EC2 = mock_ec2_class
-        mock_import.return_value = mock_module
+        from diagrams.aws.compute import EC2
+
+        assert get_node_class("ec2", CloudProvider.AWS) is EC2
 
-        result = get_node_class("ec2", CloudProvider.AWS)
-        assert result == mock_ec2_class
+    def test_get_node_class_normalizes_service_name(self):
+        """Test service names are normalized before lookup."""
+        from diagrams.azure.network import LoadBalancers
+        from diagrams.gcp.network import LoadBalancing
 
-    def test_get_node_class_invalid_service(self):
-        """Test error for invalid service."""
-        with pytest.raises(ValueError, match="Service 'invalid' not found"):
-            get_node_class("invalid", CloudProvider.AWS)
+        assert get_node_class("Cloud Load-Balancer", CloudProvider.GCP) is LoadBalancing
+        assert get_node_class("load balancer", CloudProvider.AZURE) is LoadBalancers
 
-    def test_get_node_class_invalid_provider(self):
-        """Test error for invalid provider."""
-        with pytest.raises(ValueError, match="Unsupported provider"):
-            get_node_class("ec2", "invalid")
+    @pytest.mark.parametrize(
+        ("service", "provider", "pattern"),
+        [
+            ("invalid", CloudProvider.AWS, _RE_SERVICE_NOT_FOUND),
+            ("ec2", "invalid", _RE_UNSUPPORTED_PROVIDER),
+        ],
+    )
+    def test_get_node_class_invalid(self, service, provider, pattern):
+        """Test errors for unknown services and providers."""
+        with pytest.raises(ValueError, match=pattern):
+            get_node_class(service, provider)
 
 
 class TestDiagramBuilder:
@@ -49,48 +91,40 @@ class TestDiagramBuilder:
         assert builder.connections == []
 
     @patch("src.tools.diagram_tools.get_node_class")
-    def test_add_node(self, mock_get_class):
+    def test_add_node(self, mock_get_class, builder):
         """Test adding a node."""
-        mock_class = MagicMock()
-        mock_get_class.return_value = mock_class
+        mock_get_class.return_value = FakeNode
 
-        builder = DiagramBuilder("Test")
         builder.add_node("node1", "ec2", CloudProvider.AWS, "Web Server")
 
         assert "node1" in builder.nodes
-        assert builder.nodes["node1"]["label"] == "Web Server"
+        assert builder.nodes["node1"].node_class is FakeNode
+        assert builder.nodes["node1"].label == "Web Server"
         mock_get_class.assert_called_once_with("ec2", CloudProvider.AWS)
 
-    def test_add_cluster(self):
+    def test_add_cluster(self, builder):
         """Test adding a cluster."""
-        builder = DiagramBuilder("Test")
         builder.add_cluster("web", "Web Tier")
 
         assert "web" in builder.clusters
-        assert builder.clusters["web"]["label"] == "Web Tier"
+        assert builder.clusters["web"].label == "Web Tier"
 
-    def test_connect_nodes(self):
+    def test_connect_nodes(self, builder):
         """Test connecting nodes."""
-        builder = DiagramBuilder("Test")
         builder.connect_nodes("node1", "node2", "connects")
 
         assert len(builder.connections) == 1
         connection = builder.connections[0]
-        assert connection["source"] == "node1"
-        assert connection["target"] == "node2"
-        assert connection["label"] == "connects"
+        assert connection.source == "node1"
+        assert connection.target == "node2"
+        assert connection.label == "connects"
 
 
 class TestDiagramGeneration:
     """Test diagram generation from description."""
 
-    @patch("src.tools.diagram_tools.DiagramBuilder")
-    def test_create_diagram_web_app(self, mock_builder_class):
+    def test_create_diagram_web_app(self, mock_builder):
         """Test creating diagram for web application."""
-        mock_builder = MagicMock()
-        mock_builder_class.return_value = mock_builder
-        mock_builder.render.return_value = "/tmp/test.png"
-
         create_diagram_from_description("web application with database")
 
         # Verify builder was called with expected methods
@@ -99,18 +133,112 @@ class TestDiagramGeneration:
         mock_builder.connect_nodes.assert_called()
         mock_builder.render.assert_called_once()
 
-    @patch("src.tools.diagram_tools.DiagramBuilder")
-    def test_create_diagram_load_balancer(self, mock_builder_class):
+    def test_create_diagram_load_balancer(self, mock_builder):
         """Test creating diagram with load balancer."""
-        mock_builder = MagicMock()
-        mock_builder_class.return_value = mock_builder
-        mock_builder.render.return_value = "/tmp/test.png"
-        mock_builder.nodes = {"web1": {}}  # Mock existing web node
-
         create_diagram_from_description("load balancer with web servers")
 
-        mock_builder.add_node.assert_called()
-        mock_builder.connect_nodes.assert_called()
+        mock_builder.add_node.assert_any_call(
+            "lb1", "alb", CloudProvider.AWS, "Load Balancer"
+        )
+        mock_builder.connect_nodes.assert_any_call("lb1", "web1", "routes")
+
+    def test_cache_key_shared_by_matching_features(self):
+        """Test descriptions with the same features share a cache key."""
+        assert diagram_cache_key("Web app with DB") == diagram_cache_key(
+            "database behind a web tier",
+            CloudProvider.AWS,
+            DiagramDirection.TOP_BOTTOM,
+        )
+        assert diagram_cache_key("web app") != diagram_cache_key("web app with db")
+        assert diagram_cache_key("web app with db") != diagram_cache_key(
+            "web app with db", CloudProvider.GCP
+        )
+        assert diagram_cache_key("web app with db") != diagram_cache_key(
+            "web app with db", direction=DiagramDirection.LEFT_RIGHT
+        )
+
+    def test_create_diagram_cache_hit(self, monkeypatch, tmp_path):
+        """Test cached diagrams are returned without rendering."""
+        description = "web servers and a database"
+        cached_path = tmp_path / f"diagram_{diagram_cache_key(description)}.png"
+        cached_path.write_bytes(b"png")
+
+        def fail_build(*args, **kwargs):
+            raise AssertionError("cached diagram was rebuilt")
+
+        monkeypatch.setattr(diagram_tools, "DiagramBuilder", fail_build)
+
+        assert create_diagram_from_description(description) == cached_path
+
+    def test_create_diagram_failed_render_leaves_no_file(self, monkeypatch, tmp_path):
+        """Test a render that dies part way never becomes a cache entry."""
+
+        def partial_render(self, output_path):
+            output_path.write_bytes(b"partial")
+            raise RuntimeError("dot was killed")
+
+        monkeypatch.setattr(DiagramBuilder, "render", partial_render)
+
+        with pytest.raises(RuntimeError, match="dot was killed"):
+            create_diagram_from_description("web application with database")
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_create_diagram_cache_hit_survives_cleanup(self, tmp_path):
+        """Test a cache hit keeps an old diagram from being swept."""
+        description = "web servers and a database"
+        cached_path = tmp_path / f"diagram_{diagram_cache_key(description)}.png"
+        cached_path.write_bytes(b"png")
+        rendered_at = time.time() - 59.9 * 60
+        os.utime(cached_path, (rendered_at, rendered_at))
+
+        create_diagram_from_description(description)
+        file_manager.cleanup_old_files(max_age_minutes=1)
+
+        assert cached_path.exists()
+        assert cached_path.stat().st_mtime == rendered_at
+
+
+class TestValidators:
+    """Test input validators."""
+
+    @pytest.mark.parametrize(
+        ("description", "pattern"),
+        [
+            ("too short", _RE_TOO_SHORT),
+            ("x" * 2001, _RE_TOO_LONG),
+            ("Web app <script>alert(1)</script>", _RE_UNSAFE),
+            ("Web app linking to JavaScript:alert(1)", _RE_UNSAFE),
+            ("Web app that calls eval (payload)", _RE_UNSAFE),
+            ("Web app that calls exec(payload)", _RE_UNSAFE),
+            ("Web app <\u017fcript>alert(1)", _RE_UNSAFE),
+            ("Web app linking java\u017fcript:alert(1)", _RE_UNSAFE),
+            ("Web app with <SCR\u0130PT> tag", _RE_UNSAFE),
+        ],
+    )
+    def test_validate_description_invalid(self, description, pattern):
+        """Test invalid descriptions are rejected with a matching message."""
+        with pytest.raises(ValidationError, match=pattern):
+            validate_description(description)
+
+    def test_validate_description_safe(self):
+        """Test ordinary descriptions pass."""
+        validate_description("Web app executing queries against a database")
+
+    @pytest.mark.parametrize(
+        ("service", "expected"),
+        [
+            ("EC2", "ec2"),
+            ("ec2", "ec2"),
+            ("Load-Balancer", "load_balancer"),
+            ("load balancer", "load_balancer"),
+            ("Cloud Load-Balancer", "cloud_load_balancer"),
+            ("Cloud_SQL", "cloud_sql"),
+        ],
+    )
+    def test_normalize_service_name(self, service, expected):
+        """Test service names are lowercased with separators unified."""
+        assert normalize_service_name(service) == expected
 
 
 if __name__ == "__main__":